@@ -3,9 +3,16 @@ import re
 import sys
 import time
 import logging
+from email.message import Message
+import sqlite3
+import threading
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 from urllib.parse import urljoin, urlparse
 
 logging.basicConfig(level="INFO", format="[%(levelname)s] - %(message)s")
@@ -13,129 +20,365 @@ log = logging.getLogger(__name__)
 
 START_URL = "http://127.0.0.1:48626/hom/hou/index.html"
 
+# Number of pages buffered before they are written to disk
+WRITE_BATCH_SIZE = 64
+WRITE_WORKERS = 4
+
+# Crawl state kept in the output directory to resume interrupted crawls
+STATE_FILENAME = ".scraper_state.db"
+
+# Meta tags declaring the page encoding, <meta charset> or <meta http-equiv="Content-Type">
+CHARSET_META_XPATH = (
+    "//meta[@charset]"
+    " | //meta[translate(@http-equiv, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz') = 'content-type']"
+)
+
+INVALID_FILENAME_CHARS = re.compile(r'[\\/*?:"<>|]')
+
+@lru_cache(maxsize=200_000)
+def _filename_from_url(base_url, url):
+    """Convert URL to a valid filename, relative to base_url"""
+    # Remove query parameters and fragments
+    url = url.partition("?")[0].partition("#")[0]
+    
+    # Get the last part of the URL path
+    log.debug(f"URL: {url}")
+
+    # Slice the base URL off instead of searching the whole string for it
+    filename = url[len(base_url):] if url.startswith(base_url) else url
+    filename = filename.replace("/", "_")
+
+    # If filename is empty (URL ends with /), use the domain name
+    if not filename:
+        filename = urlparse(url).netloc
+    
+    # Replace invalid filename characters
+    filename = INVALID_FILENAME_CHARS.sub("_", filename)
+    
+    # If filename doesn't end with .html, add it
+    if not filename.endswith(".html"):
+        filename += ".html"
+
+    # Remove leading underscores
+    filename = filename.lstrip("_")
+
+    log.debug(f"Filename: {filename}")
+        
+    return filename
+
+
 class DocumentationScraper:
-    def __init__(self, start_url, output_dir="scraped_docs", delay=1):
+    def __init__(self, start_url, output_dir="scraped_docs", delay=1, max_workers=16, state_file=None, force=False):
         """
         Initialize the scraper with a starting URL and output directory.
+
+        Visited pages and the remaining frontier are stored in a SQLite
+        database, so running the scraper again resumes where it stopped.
+        A page already present in the output directory is not downloaded
+        again when every link in it points to a URL the crawler already
+        knows, see _reuse_saved_page. Setting force clears the stored state
+        and downloads everything from the start URL again.
         
         Args:
             start_url (str): The URL to start scraping from
             output_dir (str): Directory to save scraped content
-            delay (float): Time to wait between requests (in seconds)
+            delay (float): Time to wait between requests (in seconds), shared by all workers
+            max_workers (int): Number of pages fetched concurrently
+            state_file (str): Crawl state database (defaults to a file in output_dir)
+            force (bool): Ignore the stored crawl state and the saved pages
         """
         self.start_url = start_url
-        self.base_url = f"{urlparse(start_url).scheme}://{urlparse(start_url).netloc}"
+        parsed_url = urlparse(start_url)
+        self.base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
+        # Documentation pages live next to the start page
+        self._doc_prefix = start_url.rsplit("/", 1)[0] + "/"
         self.output_dir = output_dir
         self.delay = delay
-        self.visited_urls = set()
-        self.to_visit = [start_url]
+        # Requests are spaced by delay across all workers
+        self._delay_lock = threading.Lock()
+        self._next_request_time = 0.0
+        self.max_workers = max_workers
+        self.force = force
+        # Processed pages waiting to be written, as (url, file_path, content)
+        self._write_buffer = []
+        # Frontier changes not yet stored in the state database
+        self._frontier_added = []
+        self._frontier_removed = []
+        # Pages reused from disk, not yet stored in the state database
+        self._reused_urls = []
+
+        # Reuse connections between requests, sized for the worker threads
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": "Mozilla/5.0 (Documentation Scraper)",
+            "Accept-Encoding": "gzip, deflate",
+        })
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=max(32, max_workers))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         
         # Create output directory if it doesn't exist
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
+
+        if state_file is None:
+            state_file = os.path.join(output_dir, STATE_FILENAME)
+
+        self._state = sqlite3.connect(state_file)
+        self._state.execute("PRAGMA journal_mode=WAL")
+        self._state.execute("PRAGMA synchronous=NORMAL")
+        self._state.execute("CREATE TABLE IF NOT EXISTS visited(url TEXT PRIMARY KEY)")
+        self._state.execute("CREATE TABLE IF NOT EXISTS frontier(url TEXT PRIMARY KEY)")
+
+        if force:
+            with self._state:
+                self._state.execute("DELETE FROM visited")
+                self._state.execute("DELETE FROM frontier")
+
+        # Resume from the previous run, if any
+        self.visited_urls = {url for url, in self._state.execute("SELECT url FROM visited")}
+        frontier = [url for url, in self._state.execute("SELECT url FROM frontier ORDER BY rowid")]
+        self.to_visit = deque(frontier or [start_url])
+        if self.visited_urls or frontier:
+            log.info(f"Resuming: {len(self.visited_urls)} pages visited, {len(frontier)} queued")
+
+        # Every URL ever added to to_visit, for constant time membership checks
+        self.queued = self.visited_urls | set(self.to_visit)
+
+        # Saved pages only link to local filenames, map them back to URLs
+        self._url_by_filename = {}
+        for url in self.queued:
+            self._url_by_filename.setdefault(self.get_filename_from_url(url), url)
     
     def get_filename_from_url(self, url):
         """Convert URL to a valid filename"""
-        # Remove query parameters and fragments
-        url = url.split("?")[0].split("#")[0]
-        
-        # Get the last part of the URL path
-        log.debug(f"URL: {url}")
+        return _filename_from_url(self.base_url, url)
 
-        filename = url.replace(self.base_url, "")
-        filename = filename.replace("/", "_")
+    def get_local_href(self, url, href):
+        """
+        Resolve a link found on the page at url to its local equivalent.
 
-        # If filename is empty (URL ends with /), use the domain name
-        if not filename:
-            filename = urlparse(url).netloc
+        Returns:
+            str: The local href, or None if the link should be removed
+        """
+        absolute_url = urljoin(url, href)
         
-        # Replace invalid filename characters
-        filename = re.sub(r'[\\/*?:"<>|]', '_', filename)
+        base_url, has_fragment, fragment = absolute_url.partition("#")
         
-        # If filename doesn't end with .html, add it
-        if not filename.endswith(".html"):
-            filename += ".html"
-
-        # Remove leading underscores
-        filename = filename.lstrip("_")
-
-        log.debug(f"Filename: {filename}")
+        # Handle fragments (anchors within the same page)
+        if has_fragment:
             
-        return filename
+            # If base URL is a doc page, replace with local link + fragment
+            if self.is_documentation_page(base_url):
+                local_filename = self.get_filename_from_url(base_url)
+                return f"{local_filename}#{fragment}"
+            # If it"s a fragment in the current page, keep it as is
+            elif base_url == url:
+                return f"#{fragment}"
+            # Otherwise, remove the link
+            return None
+        
+        # If it's a documentation page we've visited, replace with local path
+        if self.is_documentation_page(absolute_url):
+            return self.get_filename_from_url(absolute_url)
+        # Otherwise, remove the link
+        return None
 
-    def process_html_content(self, url, html_content):
+    def process_html_content(self, url, root):
         """
-        Process HTML content to:
+        Process the parsed HTML content to:
         1. Replace documentation links with local file paths
         2. Remove non-documentation links
+
+        The tree is modified in place.
         """
-        soup = BeautifulSoup(html_content, "html.parser")
+        # Navigation repeats the same links on every page, resolve each href once
+        local_hrefs = {}
         
         # Process all anchor tags
-        for a_tag in soup.find_all("a", href=True):
-            href = a_tag["href"]
-            absolute_url = urljoin(url, href)
+        for a_tag in root.xpath("//a[@href]"):
+            href = a_tag.get("href")
+            if href not in local_hrefs:
+                local_hrefs[href] = self.get_local_href(url, href)
+            local_href = local_hrefs[href]
             
-            # Handle fragments (anchors within the same page)
-            if "#" in absolute_url:
-                base_url = absolute_url.split("#")[0]
-                fragment = absolute_url.split("#")[1]
-                
-                # If base URL is a doc page, replace with local link + fragment
-                if self.is_documentation_page(base_url):
-                    local_filename = self.get_filename_from_url(base_url)
-                    a_tag["href"] = f"{local_filename}#{fragment}"
-                # If it"s a fragment in the current page, keep it as is
-                elif base_url == url:
-                    a_tag["href"] = f"#{fragment}"
-                # Otherwise, remove the link but keep the text
-                else:
-                    a_tag.replace_with(a_tag.text)
-            # Handle regular links
+            # Remove the link but keep its content
+            if local_href is None:
+                a_tag.drop_tag()
             else:
-                # If it's a documentation page we've visited, replace with local path
-                if self.is_documentation_page(absolute_url):
-                    local_filename = self.get_filename_from_url(absolute_url)
-                    a_tag["href"] = local_filename
-                # Otherwise, remove the link but keep the text
-                else:
-                    a_tag.replace_with(a_tag.text)
+                a_tag.set("href", local_href)
+        
+        # The page is written as UTF-8, replace whatever charset it declared
+        for meta in root.xpath(CHARSET_META_XPATH):
+            meta.drop_tree()
+
+        head = root.find("head")
+        if head is None:
+            head = root.makeelement("head")
+            root.insert(0, head)
+        head.insert(0, head.makeelement("meta", charset="utf-8"))
         
-        return str(soup)
+        # Serialize the whole document to keep the doctype, straight to UTF-8 bytes
+        return lxml.html.tostring(root.getroottree(), encoding="utf-8")
     
-    def save_content(self, url, content):
-        """Save the content to a file"""
+    def save_content(self, url, root):
+        """Save the parsed content to a file"""
         # Process the HTML content to handle links
-        processed_content = self.process_html_content(url, content)
+        processed_content = self.process_html_content(url, root)
         
         filename = self.get_filename_from_url(url)
         file_path = os.path.join(self.output_dir, filename)
 
         if os.path.exists(file_path):
-            log.warning(f"File already exists: {file_path}")
+            log.debug(f"Overwriting: {file_path}")
         
-        with open(file_path, "w", encoding="utf-8") as file:
-            file.write(processed_content)
-            
-        log.info(f"Saved: {url} -> {file_path}")
+        # Defer the write so disk flushes don't block the crawl loop
+        self._write_buffer.append((url, file_path, processed_content))
+        if len(self._write_buffer) >= WRITE_BATCH_SIZE:
+            self.flush_writes()
+
+    def _write_file(self, url, file_path, content):
+        """Write a single processed page, already encoded as bytes, to disk"""
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            # os.write may write less than requested, loop until done
+            view = memoryview(content)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+
+        log.debug(f"Saved: {url} -> {file_path}")
+
+    def flush_writes(self):
+        """Write every buffered page to disk, then record them in the crawl state"""
+        buffer, self._write_buffer = self._write_buffer, []
+        if buffer:
+            with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+                # Consume the results so write errors are raised here
+                list(executor.map(self._write_file, *zip(*buffer)))
+
+        reused, self._reused_urls = self._reused_urls, []
+        self._save_state([url for url, _, _ in buffer] + reused)
+
+    def _save_state(self, saved_urls):
+        """Store saved pages and frontier changes in a single transaction"""
+        added, self._frontier_added = self._frontier_added, []
+        removed, self._frontier_removed = self._frontier_removed, []
+
+        with self._state:
+            self._state.executemany("INSERT OR IGNORE INTO visited(url) VALUES (?)", ((url,) for url in saved_urls))
+            # Add before removing, a URL may have been queued and visited since the last save
+            self._state.executemany("INSERT OR IGNORE INTO frontier(url) VALUES (?)", ((url,) for url in added))
+            self._state.executemany("DELETE FROM frontier WHERE url = ?", ((url,) for url in removed))
     
     def get_page_content(self, url):
-        """Fetch and return page content"""
+        """
+        Fetch and return the raw page content.
+
+        Returns:
+            tuple: (content, charset), charset is None when the Content-Type
+                header doesn't declare one, None if the request failed
+        """
         try:
-            response = requests.get(url, headers={"User-Agent": "Mozilla/5.0 (Documentation Scraper)"})
+            response = self.session.get(url, timeout=10)
             response.raise_for_status()  # Raise exception for 4XX/5XX responses
-            return response.text
         except requests.RequestException as e:
             print(f"Error fetching {url}: {e}")
             return None
+
+        # requests falls back to ISO-8859-1 for text/* without a charset,
+        # only trust a charset the server actually sent
+        header = Message()
+        header["Content-Type"] = response.headers.get("Content-Type", "")
+        return response.content, header.get_content_charset()
+
+    def parse_html(self, html_content, charset=None):
+        """
+        Parse a whole HTML document.
+
+        Args:
+            html_content (bytes): The raw page content
+            charset (str): Encoding declared by the server, if any. Without it,
+                lxml detects the encoding from the page's meta tags
+        """
+        parser = None
+        if charset:
+            try:
+                parser = lxml.html.HTMLParser(encoding=charset)
+            except LookupError:
+                log.warning(f"Unknown charset {charset}, detecting it from the page")
+
+        return lxml.html.document_fromstring(html_content, parser=parser)
     
-    def extract_links(self, url, html_content):
-        """Extract links from the HTML content that are part of the documentation"""
-        soup = BeautifulSoup(html_content, "html.parser")
+    def saved_links_known(self, root):
+        """
+        Check that every link of a page saved by a previous run points to a known URL.
+
+        Saved pages link to local filenames only, which can't be turned back
+        into URLs reliably. They are matched against the URLs already known to
+        the crawler instead.
+        """
+        for href in root.xpath("//a/@href"):
+            filename = href.partition("#")[0]
+            if not filename or "/" in filename:
+                continue
+
+            if filename not in self._url_by_filename:
+                log.debug(f"Unknown saved link: {filename}")
+                return False
+
+        return True
+
+    def _reuse_saved_page(self, url, file_path):
+        """
+        Skip fetching a page saved by a previous run if it can't lead anywhere new.
+
+        That is only the case when all of its links are already known URLs,
+        which are queued or visited already, so there is nothing to enqueue.
+        In practice this covers leaf pages and pages linking back to ones the
+        crawl has reached, the others are fetched again for their real links.
+
+        Returns:
+            bool: False if the page has to be fetched again to find its links
+        """
+        with open(file_path, "rb") as file:
+            html_content = file.read()
+
+        try:
+            # Saved pages are always written as UTF-8
+            root = self.parse_html(html_content, "utf-8")
+        except etree.ParserError as e:
+            log.error(f"Error parsing {file_path}: {e}")
+            return False
+
+        if not self.saved_links_known(root):
+            return False
+
+        self._reused_urls.append(url)
+
+        log.debug(f"Already saved: {url} -> {file_path}")
+        return True
+
+    def _enqueue_links(self, links):
+        """Add the links that were never queued to the to_visit list"""
+        new_links = set(links) - self.visited_urls - self.queued
+        if not new_links:
+            return
+
+        # Keep the page order so the crawl stays breadth first and repeatable
+        ordered_links = [link for link in dict.fromkeys(links) if link in new_links]
+        self.to_visit.extend(ordered_links)
+        self.queued |= new_links
+        self._frontier_added.extend(ordered_links)
+        for link in ordered_links:
+            self._url_by_filename.setdefault(self.get_filename_from_url(link), link)
+
+    def extract_links(self, url, root):
+        """Extract links from the parsed HTML content that are part of the documentation"""
         links = []
         
-        for a_tag in soup.find_all("a", href=True):
-            href = a_tag["href"]
+        for href in root.xpath("//a/@href"):
             absolute_url = urljoin(url, href)
             
             # Only follow links to the same domain and avoid external links
@@ -150,8 +393,48 @@ class DocumentationScraper:
         This is a basic implementation that you might need to customize.
         """
         # Check URL pattern (modify this based on the documentation structure)
-        return False if not url.startswith(START_URL.replace("index.html", "")) else True
+        return url.startswith(self._doc_prefix)
     
+    def _wait_for_delay(self):
+        """Block until delay seconds have passed since the previous request started"""
+        with self._delay_lock:
+            wait = self._next_request_time - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._next_request_time = time.monotonic() + self.delay
+
+    def _fetch_and_parse(self, url):
+        """
+        Fetch and parse a page from a worker thread.
+
+        Returns:
+            tuple: (root, links) for documentation pages, None otherwise
+        """
+        # Respect the delay between requests
+        if self.delay:
+            self._wait_for_delay()
+
+        # Get the page content
+        page = self.get_page_content(url)
+
+        # Check if it's a documentation page
+        if page is None or not page[0] or not self.is_documentation_page(url):
+            return None
+
+        html_content, charset = page
+
+        # Parse the page once and share the tree between helpers
+        try:
+            root = self.parse_html(html_content, charset)
+        except etree.ParserError as e:
+            log.error(f"Error parsing {url}: {e}")
+            return None
+
+        # Extract links from the page before they get rewritten
+        links = self.extract_links(url, root)
+
+        return root, links
+
     def scrape(self, max_pages=None):
         """
         Scrape the documentation starting from the initial URL.
@@ -161,47 +444,65 @@ class DocumentationScraper:
         """
         page_count = 0
         
-        while self.to_visit and (max_pages is None or page_count < max_pages):
-            log.info(f"Pages scraped: {page_count}")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                while self.to_visit and (max_pages is None or page_count < max_pages):
+                    # Each fetch yields at most one page, don't go over the limit
+                    batch_size = self.max_workers
+                    if max_pages is not None:
+                        batch_size = min(batch_size, max_pages - page_count)
+
+                    # Get the next URLs to visit
+                    batch = []
+                    while self.to_visit and len(batch) < batch_size:
+                        current_url = self.to_visit.popleft()
+
+                        # Skip if already visited
+                        if current_url in self.visited_urls:
+                            self._frontier_removed.append(current_url)
+                            continue
+
+                        log.debug(f"Scraping: {current_url}")
+
+                        # Mark as visited
+                        self.visited_urls.add(current_url)
+
+                        # Reuse the copy saved by a previous run instead of fetching it again
+                        if not self.force and self.is_documentation_page(current_url):
+                            file_path = os.path.join(self.output_dir, self.get_filename_from_url(current_url))
+                            if os.path.exists(file_path) and self._reuse_saved_page(current_url, file_path):
+                                self._frontier_removed.append(current_url)
+                                continue
+
+                        batch.append(current_url)
+
+                    # Fetch and parse the pages concurrently, shared state is only touched here.
+                    # Results are handled in submission order so the crawl order is repeatable
+                    futures = [(url, executor.submit(self._fetch_and_parse, url)) for url in batch]
+                    for current_url, future in futures:
+                        result = future.result()
+
+                        # Only drop a URL from the stored frontier once it was handled,
+                        # an interrupted batch is picked up again on the next run
+                        if result is None:
+                            self._frontier_removed.append(current_url)
+                            continue
+
+                        root, links = result
+
+                        # Save the content
+                        self.save_content(current_url, root)
+                        self._frontier_removed.append(current_url)
+                        page_count += 1
+                        if page_count % 100 == 0:
+                            log.info(f"Pages scraped: {page_count}")
+
+                        # Add new links to the to_visit list
+                        self._enqueue_links(links)
+            finally:
+                # Write whatever is still buffered, even if the crawl was interrupted
+                self.flush_writes()
 
-            # Get the next URL to visit
-            current_url = self.to_visit.pop(0)
-            
-            # Skip if already visited
-            if current_url in self.visited_urls:
-                continue
-                
-            log.info(f"Scraping: {current_url}")
-            
-            # Mark as visited
-            self.visited_urls.add(current_url)
-            
-            # Get the page content
-            html_content = self.get_page_content(current_url)
-            if not html_content:
-                continue
-                
-            # Check if it's a documentation page
-            if self.is_documentation_page(current_url):
-                log.info("Start")
-                # Save the content
-                self.save_content(current_url, html_content)
-                page_count += 1
-                
-                # Extract links from the page
-                links = self.extract_links(current_url, html_content)
-                
-                # Add new links to the to_visit list
-                for link in links:
-                    if link not in self.visited_urls and link not in self.to_visit:
-                        self.to_visit.append(link)
-                
-                log.info("End")
-                print("\n")
-            
-            # Respect the delay between requests
-            time.sleep(self.delay)
-            
         log.info(f"Scraping complete. Scraped {page_count} pages.")
 
 # Example usage
@@ -212,7 +513,8 @@ if __name__ == "__main__":
     scraper = DocumentationScraper(
         start_url=START_URL,
         output_dir="scraped_documentation",
-        delay=0  # Be nice to the server: 2 seconds between requests
+        delay=0,  # Be nice to the server: 2 seconds between requests
+        max_workers=16
     )
     
     # Start scraping (limit to 100 pages)